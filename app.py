@@ -1,36 +1,39 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import plotly.graph_objects as go
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from dataclasses import asdict, dataclass, fields
 from datetime import datetime
 import json
+import re
 import hashlib
+import hmac
+import importlib.util
 import os
 import secrets  # for secure token generation
+import threading
+import time
 
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 
 import extra_streamlit_components as stx  # cookies
 
-# PDF generation
-try:
-    from fpdf import FPDF
-    FPDF_AVAILABLE = True
-except ImportError:
-    FPDF_AVAILABLE = False
-
-from openai import OpenAI
+# plotly, numpy, fpdf and openai are imported inside the functions that use
+# them, so the sign-in screen doesn't pay for loading them.
 
 
 # =========================================================
 # 0. OPENAI CLIENT & SYSTEM PROMPT
 # =========================================================
 
+@st.cache_resource
 def get_openai_client():
     """
     Load API key from Streamlit secrets or environment variables.
     Never hardcode it in the source code.
+    Cached so the client's HTTP connection pool survives reruns.
     """
     api_key = None
     try:
@@ -46,7 +49,15 @@ def get_openai_client():
             "OpenAI API key not found. Set OPENAI_API_KEY in Streamlit secrets or environment variables."
         )
 
-    return OpenAI(api_key=api_key)
+    from openai import DefaultHttpxClient, OpenAI, Timeout
+
+    # Keep-alive pool shared across reruns; HTTP/2 multiplexing when h2 is installed.
+    http_client = DefaultHttpxClient(http2=importlib.util.find_spec("h2") is not None)
+    return OpenAI(
+        api_key=api_key,
+        http_client=http_client,
+        timeout=Timeout(60.0, connect=5.0),
+    )
 
 
 TERMSHEETGPT_SYSTEM_PROMPT = """
@@ -103,7 +114,7 @@ Explanations must be short and tied directly to negotiation.
 
 2. DATA INPUT FORMAT
 
-You will receive a single JSON object containing founder, company, round, traction, proposed terms, priorities, and investor context fields.
+You will receive a single JSON object containing founder, company, round, traction, proposed terms, priorities, investor context, and precomputed analytics fields.
 
 Some fields may be missing.
 When missing:
@@ -142,6 +153,12 @@ Do not reveal these steps.
 
 5. OUTPUT FORMAT (MANDATORY)
 
+Length limits (hard caps):
+- Analysis text: max 40 words per section.
+- Negotiation moves: max 3 bullets per section, one line each.
+- Example language: max 2 short lines per section.
+- Do not repeat the question; do not restate the inputs.
+
 Always return Markdown structured like this:
 
 Deal Summary
@@ -189,7 +206,7 @@ Long-term implications for Series A/B
 
 Negotiation Moves
 
-(3–6 specific tactics)
+(Up to 3 specific tactics)
 
 Example Language
 
@@ -256,7 +273,11 @@ Then follow the mandatory output structure above.
 
 8. FINANCIAL SIMULATION (WHEN INPUTS PROVIDED)
 
-You may run:
+The JSON includes a "precomputed_analytics" block (post-money valuation, ownership split, implied revenue multiple, and liquidation waterfall payouts at 0.5×, 1× and 2× the assumed exit). These numbers are computed exactly by the app.
+Trust precomputed_analytics — do not recompute these figures; cite them verbatim.
+The JSON may also include a "pre_flagged" list of founder-unfriendly terms the app has already detected (PARTICIPATING_LIQ, >1x_LIQ, FULL_RATCHET, BIG_POOL). Reference each tag by name in the section it belongs to (PARTICIPATING_LIQ and >1x_LIQ in "2. Liquidation Preference Analysis"; FULL_RATCHET and BIG_POOL in "3. Dilution Analysis") and let them inform the Deal Summary verdict; don't rediscover or re-explain them at length.
+
+Beyond those figures, you may run:
 
 Dilution modeling
 Liquidation waterfall comparisons
@@ -334,30 +355,169 @@ def build_json_payload(user_name: str, inputs: dict) -> dict:
             "leverage": inputs.get("leverage"),
             "reputation": inputs.get("investor_reputation"),
         },
+        "precomputed_analytics": compute_analytics(inputs),
+        "pre_flagged": fast_flags(inputs),
     }
     return payload
 
 
-def call_termsheet_gpt_with_json(payload: dict) -> str:
-    client = get_openai_client()
-    user_content = (
+def _fingerprint(obj) -> str:
+    """blake2b of the canonical (sorted, compact) JSON form of obj."""
+    canonical = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def hash_inputs(inputs: dict) -> str:
+    """Stable fingerprint of the form inputs, used to detect unchanged resubmits."""
+    return _fingerprint(inputs)
+
+
+# Changes whenever the system prompt text does, so cached analyses written
+# under an older prompt are not served after a deploy.
+_PROMPT_FINGERPRINT = _fingerprint(TERMSHEETGPT_SYSTEM_PROMPT)
+
+
+def recs_cache_key(payload: dict) -> str:
+    """
+    Response-cache key: identical deal contexts map to the same analysis, as
+    long as the system prompt and the configured models are unchanged.
+    """
+    return _fingerprint({
+        "payload": payload,
+        "prompt": _PROMPT_FINGERPRINT,
+        "models": _analysis_models(),
+    })
+
+
+API_ERROR_PREFIX = "⚠️ Error calling TermSheetGPT API"
+
+RECS_CACHE_TTL_SECONDS = 24 * 60 * 60
+RECS_CACHE_MAX_ENTRIES = 128
+
+
+@st.cache_resource
+def _recs_cache():
+    """
+    Process-wide store of finished analyses: recs_cache_key -> (stored_at, text),
+    with the lock that guards it. A plain dict rather than st.cache_data so
+    streamed responses can be written once they complete. The lock lives here,
+    not at module level, because Streamlit re-executes this script on every
+    rerun and a module-level lock would not be shared between sessions.
+    """
+    return threading.Lock(), {}
+
+
+def _get_cached_recs(key: str):
+    lock, cache = _recs_cache()
+    with lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        stored_at, recs = entry
+        if time.time() - stored_at > RECS_CACHE_TTL_SECONDS:
+            cache.pop(key, None)
+            return None
+        return recs
+
+
+def _store_recs(key: str, recs: str):
+    lock, cache = _recs_cache()
+    with lock:
+        cache.pop(key, None)
+        cache[key] = (time.time(), recs)
+        # Dicts keep insertion order, so the first key is the oldest entry.
+        while len(cache) > RECS_CACHE_MAX_ENTRIES:
+            cache.pop(next(iter(cache)), None)
+
+
+def forget_cached_recs(payload: dict):
+    """Drop the cached analysis for this deal so the next call asks the model again."""
+    lock, cache = _recs_cache()
+    with lock:
+        cache.pop(recs_cache_key(payload), None)
+
+
+def _build_user_content(payload: dict) -> str:
+    return (
         "Here is the deal context as a JSON object. "
         "Use it to perform the negotiation-focused analysis described in your instructions.\n\n"
         + json.dumps(payload, indent=2)
     )
 
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": TERMSHEETGPT_SYSTEM_PROMPT},
-                {"role": "user", "content": user_content},
-            ],
-            temperature=0.3,
-        )
-        return resp.choices[0].message.content
-    except Exception as e:
-        return f"⚠️ Error calling TermSheetGPT API: {e}"
+
+# OpenAI caches identical prompt prefixes of 1024+ tokens. The system prompt is
+# that prefix, so it must stay first and byte-identical: nothing per-request
+# goes into it. Requests sharing a prompt_cache_key are routed to the same
+# cache shard.
+PROMPT_CACHE_KEY = "tsgpt-v1"
+
+
+def _termsheet_gpt_messages(user_content: str) -> list:
+    return [
+        {"role": "system", "content": TERMSHEETGPT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
+    ]
+
+
+# The smaller model handles the templated output well and is much faster; the
+# larger one is only used when the smaller one's answer is incomplete.
+MODEL_PRIMARY = os.environ.get("TSGPT_MODEL", "gpt-4o-mini")
+MODEL_FALLBACK = "gpt-4o"
+MIN_ANALYSIS_CHARS = 500
+# Hard cap on generated tokens; the prompt's length limits keep answers well under it.
+MAX_OUTPUT_TOKENS = 1400
+REQUIRED_SECTIONS = ("Deal Summary", "Your Top 3 Moves")
+
+
+def is_complete_analysis(recs: str) -> bool:
+    return (
+        len(recs) >= MIN_ANALYSIS_CHARS
+        and all(section in recs for section in REQUIRED_SECTIONS)
+    )
+
+
+def _analysis_models() -> tuple:
+    # dict.fromkeys de-duplicates while keeping order (TSGPT_MODEL may be gpt-4o).
+    return tuple(dict.fromkeys((MODEL_PRIMARY, MODEL_FALLBACK)))
+
+
+def stream_termsheet_gpt(
+    payload: dict,
+    prompt_cache_key: str = PROMPT_CACHE_KEY,
+    model: str = MODEL_PRIMARY,
+):
+    """
+    Yield the analysis as it is generated, for st.write_stream.
+    Cached responses are yielded in one piece; errors propagate to the caller.
+    """
+    cache_key = recs_cache_key(payload)
+    cached = _get_cached_recs(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    client = get_openai_client()
+    resp = client.chat.completions.create(
+        model=model,
+        messages=_termsheet_gpt_messages(_build_user_content(payload)),
+        temperature=0.3,
+        max_tokens=MAX_OUTPUT_TOKENS,
+        stream=True,
+        prompt_cache_key=prompt_cache_key,
+    )
+    parts = []
+    for chunk in resp:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    recs = "".join(parts)
+    # Incomplete answers aren't cached so the fallback model gets a chance.
+    if model == MODEL_FALLBACK or is_complete_analysis(recs):
+        _store_recs(cache_key, recs)
 
 
 # =========================================================
@@ -372,18 +532,115 @@ def get_db_config():
     return db_host, db_user, db_password, db_name
 
 
+@st.cache_resource
 def get_engine():
+    """
+    Build the SQLAlchemy engine once per process.
+    Streamlit reruns the script on every interaction, so the engine (and its
+    connection pool) is cached and shared across sessions.
+    """
     db_host, db_user, db_password, db_name = get_db_config()
     conn_str = (
         f"mysql+pymysql://{db_user}:{db_password}@{db_host}:3306/{db_name}"
         "?charset=utf8mb4"
     )
-    return create_engine(conn_str, pool_pre_ping=True)
+    return create_engine(
+        conn_str,
+        pool_size=10,
+        max_overflow=10,
+        pool_recycle=1800,
+        pool_pre_ping=True,
+        # Reuse the most recently returned connection so a few stay warm and
+        # the rest can idle out, instead of cycling through the whole pool.
+        pool_use_lifo=True,
+        query_cache_size=1200,
+    )
 
 
+# Statements are built once so SQLAlchemy's compiled cache is hit on every call.
+_Q_GET_USER = text(
+    "SELECT id, name, email, password_hash FROM users WHERE email = :email"
+)
+_Q_INSERT_USER = text("""
+    INSERT INTO users (name, email, password_hash, remember_token_hash)
+    VALUES (:name, :email, :password_hash, :remember_token_hash)
+""")
+# Deal inputs persisted as columns of `deals`; drives both the INSERT and
+# _deal_params so the two can't drift apart.
+_DEAL_COLUMNS = (
+    "company_name", "industry", "stage", "country", "currency",
+    "revenue", "growth", "description", "pre_money", "investment_amount",
+    "equity_percentage", "instrument", "liq_multiple", "liq_type",
+    "anti_dilution", "board_seats", "other_terms", "assumed_exit",
+)
+# inputs_json keeps the full form (priorities, investor context, free-text
+# terms) that has no dedicated column; form_hash is hash_inputs() of it.
+_Q_INSERT_DEAL = text(
+    "INSERT INTO deals (user_id, inputs_json, form_hash, {cols}) "
+    "VALUES (:user_id, :inputs_json, :form_hash, {params})".format(
+        cols=", ".join(_DEAL_COLUMNS),
+        params=", ".join(f":{c}" for c in _DEAL_COLUMNS),
+    )
+)
+_Q_SET_DEAL_RECS = text(
+    "UPDATE deals SET recs = :recs WHERE user_id = :uid AND form_hash = :fh"
+)
+_Q_LATEST_DEAL_WITH_RECS = text("""
+    SELECT inputs_json, form_hash, recs FROM deals
+    WHERE user_id = :uid AND recs IS NOT NULL AND inputs_json IS NOT NULL
+    ORDER BY created_at DESC
+    LIMIT 1
+""")
+_Q_SET_PASSWORD_HASH = text(
+    "UPDATE users SET password_hash = :password_hash WHERE id = :uid"
+)
+_Q_SET_REMEMBER_TOKEN = text(
+    "UPDATE users SET remember_token_hash = :th WHERE id = :uid"
+)
+_Q_CLEAR_REMEMBER_TOKEN = text(
+    "UPDATE users SET remember_token_hash = NULL WHERE id = :uid"
+)
+_Q_USER_BY_TOKEN = text(
+    "SELECT id, name, email FROM users WHERE remember_token_hash = :th"
+)
+
+
+def _column_exists(conn, table: str, column: str) -> bool:
+    row = conn.execute(
+        text("""
+            SELECT 1 FROM information_schema.COLUMNS
+            WHERE table_schema = DATABASE()
+              AND table_name = :table
+              AND column_name = :column
+        """),
+        {"table": table, "column": column},
+    ).fetchone()
+    return row is not None
+
+
+def _index_exists(conn, table: str, index: str) -> bool:
+    row = conn.execute(
+        text("""
+            SELECT 1 FROM information_schema.STATISTICS
+            WHERE table_schema = DATABASE()
+              AND table_name = :table
+              AND index_name = :index
+            LIMIT 1
+        """),
+        {"table": table, "index": index},
+    ).fetchone()
+    return row is not None
+
+
+@st.cache_resource
 def init_db():
+    """
+    Create tables / columns once per process; later reruns get the cached engine
+    back without touching the database.
+    """
     engine = get_engine()
-    with engine.connect() as conn:
+    # One connection / transaction for all DDL.
+    with engine.begin() as conn:
         conn.execute(
             text("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -396,15 +653,23 @@ def init_db():
             """)
         )
         # Add remember_token_hash column if it doesn't exist yet
-        try:
+        if not _column_exists(conn, "users", "remember_token_hash"):
             conn.execute(
                 text("""
                     ALTER TABLE users
                     ADD COLUMN remember_token_hash VARCHAR(255) NULL
                 """)
             )
-        except Exception:
-            pass
+        # Auto-login looks users up by token hash on every cookie-bearing load.
+        # MySQL UNIQUE indexes admit any number of NULLs, so signed-out users
+        # don't collide.
+        if not _index_exists(conn, "users", "idx_users_remember_token_hash"):
+            conn.execute(
+                text("""
+                    CREATE UNIQUE INDEX idx_users_remember_token_hash
+                    ON users (remember_token_hash)
+                """)
+            )
 
         conn.execute(
             text("""
@@ -429,11 +694,46 @@ def init_db():
                     board_seats INT,
                     other_terms TEXT,
                     assumed_exit DOUBLE,
+                    inputs_json JSON NULL,
+                    form_hash CHAR(32) NULL,
+                    recs MEDIUMTEXT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(id)
                 )
             """)
         )
+        if not _column_exists(conn, "deals", "inputs_json"):
+            conn.execute(
+                text("""
+                    ALTER TABLE deals
+                    ADD COLUMN inputs_json JSON NULL
+                """)
+            )
+        if not _column_exists(conn, "deals", "form_hash"):
+            conn.execute(
+                text("""
+                    ALTER TABLE deals
+                    ADD COLUMN form_hash CHAR(32) NULL,
+                    ADD COLUMN recs MEDIUMTEXT NULL
+                """)
+            )
+        # Serves per-user lookups and "latest deals first" listings; MySQL has
+        # no CREATE INDEX IF NOT EXISTS, hence the catalog check.
+        if not _index_exists(conn, "deals", "idx_deals_user_created"):
+            conn.execute(
+                text("""
+                    CREATE INDEX idx_deals_user_created
+                    ON deals (user_id, created_at DESC)
+                """)
+            )
+        # Serves the recs write-back (UPDATE ... WHERE user_id AND form_hash).
+        if not _index_exists(conn, "deals", "idx_deals_user_form_hash"):
+            conn.execute(
+                text("""
+                    CREATE INDEX idx_deals_user_form_hash
+                    ON deals (user_id, form_hash)
+                """)
+            )
     return engine
 
 
@@ -441,26 +741,99 @@ def init_db():
 # 2. AUTH HELPERS
 # =========================================================
 
+PBKDF2_ITERATIONS = 200_000
+
+
 def hash_password(password: str) -> str:
-    salt = os.urandom(16).hex()
-    digest = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
-    return f"{salt}${digest}"
+    """
+    Hash with PBKDF2-HMAC-SHA256 (OpenSSL-backed, single native call).
+    Stored as pbkdf2_sha256$<iterations>$<salt hex>$<digest hex>.
+    """
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
 
 
 def verify_password(password: str, stored_hash: str) -> bool:
+    parts = stored_hash.split("$")
+    if len(parts) == 4 and parts[0] == "pbkdf2_sha256":
+        try:
+            iterations = int(parts[1])
+            salt = bytes.fromhex(parts[2])
+            digest = bytes.fromhex(parts[3])
+        except ValueError:
+            return False
+        if iterations < 1:
+            return False
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+        return hmac.compare_digest(candidate, digest)
+
+    # Legacy format: <salt hex>$sha256(salt + password)
     try:
         salt, digest = stored_hash.split("$", 1)
+        digest = bytes.fromhex(digest)
     except ValueError:
         return False
-    candidate = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
-    return candidate == digest
+    candidate = hashlib.sha256((salt + password).encode("utf-8")).digest()
+    return hmac.compare_digest(candidate, digest)
 
 
-def get_user_by_email(email: str):
-    engine = get_engine()
-    with engine.connect() as conn:
+REMEMBER_COOKIE = "tsgpt_remember"
+REMEMBER_MAX_AGE = 60 * 60 * 24 * 30  # 30 days
+
+
+def hash_remember_token(raw_token: str) -> str:
+    """Only this hash is stored; the raw token lives in the browser cookie."""
+    return hashlib.sha256(raw_token.encode()).hexdigest()
+
+
+def new_remember_token():
+    """Return (raw_token, token_hash) for a fresh remember-me token."""
+    raw_token = secrets.token_urlsafe(32)
+    return raw_token, hash_remember_token(raw_token)
+
+
+def password_needs_rehash(stored_hash: str) -> bool:
+    """True for legacy SHA-256 hashes and PBKDF2 hashes below the current cost."""
+    parts = stored_hash.split("$")
+    if len(parts) != 4 or parts[0] != "pbkdf2_sha256":
+        return True
+    try:
+        return int(parts[1]) < PBKDF2_ITERATIONS
+    except ValueError:
+        return True
+
+
+def record_sign_in(user_id: int, password_hash: str = None, remember_token_hash: str = None):
+    """
+    Persist the writes a sign-in may need (upgraded password hash, new
+    remember-me token) on one pooled connection, in one transaction.
+    """
+    if password_hash is None and remember_token_hash is None:
+        return
+    with get_engine().begin() as conn:
+        if password_hash is not None:
+            conn.execute(
+                _Q_SET_PASSWORD_HASH,
+                {"password_hash": password_hash, "uid": user_id},
+            )
+        if remember_token_hash is not None:
+            conn.execute(
+                _Q_SET_REMEMBER_TOKEN,
+                {"th": remember_token_hash, "uid": user_id},
+            )
+    if password_hash is not None:
+        _fetch_user_by_email.clear()
+    if remember_token_hash is not None:
+        # The new hash replaces the old token; drop cached lookups of it.
+        _lookup_user_by_token_hash.clear()
+
+
+@st.cache_data(ttl=60, max_entries=1024, show_spinner=False)
+def _fetch_user_by_email(email: str):
+    with get_engine().connect() as conn:
         result = conn.execute(
-            text("SELECT id, name, email, password_hash FROM users WHERE email = :email"),
+            _Q_GET_USER,
             {"email": email},
         ).fetchone()
 
@@ -474,195 +847,272 @@ def get_user_by_email(email: str):
     return None
 
 
-def create_user(name: str, email: str, password: str):
-    engine = get_engine()
+def get_user_by_email(email: str):
+    return _fetch_user_by_email(email)
+
+
+@st.cache_data(ttl=300, max_entries=1024, show_spinner=False)
+def _lookup_user_by_token_hash(token_hash: str):
+    with get_engine().connect() as conn:
+        row = conn.execute(
+            _Q_USER_BY_TOKEN,
+            {"th": token_hash},
+        ).fetchone()
+
+    if row:
+        return {
+            "id": row[0],
+            "name": row[1],
+            "email": row[2],
+        }
+    return None
+
+
+def create_user(name: str, email: str, password: str, remember_token_hash: str = None):
     pwd_hash = hash_password(password)
     try:
-        with engine.begin() as conn:
-            conn.execute(
-                text("""
-                    INSERT INTO users (name, email, password_hash)
-                    VALUES (:name, :email, :password_hash)
-                """),
-                {"name": name, "email": email, "password_hash": pwd_hash},
+        with get_engine().begin() as conn:
+            result = conn.execute(
+                _Q_INSERT_USER,
+                {
+                    "name": name,
+                    "email": email,
+                    "password_hash": pwd_hash,
+                    "remember_token_hash": remember_token_hash,
+                },
             )
-        return get_user_by_email(email)
+        # Drop any cached "no such user" result from the signup precheck.
+        _fetch_user_by_email.clear()
+        # The INSERT already tells us the new id; no follow-up SELECT needed.
+        return {
+            "id": result.lastrowid,
+            "name": name,
+            "email": email,
+            "password_hash": pwd_hash,
+        }
     except SQLAlchemyError:
         return None
 
 
+def _deal_params(user_id: int, inputs: dict) -> dict:
+    params = {col: inputs[col] for col in _DEAL_COLUMNS}
+    params["user_id"] = user_id
+    params["inputs_json"] = json.dumps(inputs, separators=(",", ":"), default=str)
+    params["form_hash"] = hash_inputs(inputs)
+    return params
+
+
+def save_deals(user_id: int, inputs_list: list):
+    """
+    Insert several deals in one transaction.
+    A list of parameter dicts takes the executemany path, which pymysql
+    rewrites into a single multi-row INSERT ... VALUES (...), (...).
+    """
+    if not inputs_list:
+        return
+    with get_engine().begin() as conn:
+        conn.execute(
+            _Q_INSERT_DEAL,
+            [_deal_params(user_id, inputs) for inputs in inputs_list],
+        )
+
+
 def save_deal(user_id: int, inputs: dict):
-    engine = get_engine()
-    with engine.begin() as conn:
+    save_deals(user_id, [inputs])
+
+
+def save_deal_recs(user_id: int, form_hash: str, recs: str):
+    """Attach a finished analysis to the user's saved deal(s) with this form hash."""
+    with get_engine().begin() as conn:
         conn.execute(
-            text("""
-                INSERT INTO deals (
-                    user_id, company_name, industry, stage, country, currency,
-                    revenue, growth, description, pre_money, investment_amount,
-                    equity_percentage, instrument, liq_multiple, liq_type,
-                    anti_dilution, board_seats, other_terms, assumed_exit
-                ) VALUES (
-                    :user_id, :company_name, :industry, :stage, :country, :currency,
-                    :revenue, :growth, :description, :pre_money, :investment_amount,
-                    :equity_percentage, :instrument, :liq_multiple, :liq_type,
-                    :anti_dilution, :board_seats, :other_terms, :assumed_exit
-                )
-            """),
-            {
-                "user_id": user_id,
-                "company_name": inputs["company_name"],
-                "industry": inputs["industry"],
-                "stage": inputs["stage"],
-                "country": inputs["country"],
-                "currency": inputs["currency"],
-                "revenue": inputs["revenue"],
-                "growth": inputs["growth"],
-                "description": inputs["description"],
-                "pre_money": inputs["pre_money"],
-                "investment_amount": inputs["investment_amount"],
-                "equity_percentage": inputs["equity_percentage"],
-                "instrument": inputs["instrument"],
-                "liq_multiple": inputs["liq_multiple"],
-                "liq_type": inputs["liq_type"],
-                "anti_dilution": inputs["anti_dilution"],
-                "board_seats": inputs["board_seats"],
-                "other_terms": inputs["other_terms"],
-                "assumed_exit": inputs["assumed_exit"],
-            },
+            _Q_SET_DEAL_RECS,
+            {"recs": recs, "uid": user_id, "fh": form_hash},
         )
 
 
+def load_latest_deal(user_id: int):
+    """Return (inputs, form_hash, recs) for the user's latest analysed deal, or None."""
+    with get_engine().connect() as conn:
+        row = conn.execute(
+            _Q_LATEST_DEAL_WITH_RECS,
+            {"uid": user_id},
+        ).fetchone()
+
+    if row:
+        return json.loads(row[0]), row[1], row[2]
+    return None
+
+
 # =========================================================
 # 3. STYLE
 # =========================================================
 
+# Built once at import; Streamlit drops elements that are not re-emitted on a
+# rerun, so inject_css() still has to send it each run.
+_CSS = """
+<style>
+.main {
+    background-color: #020617;
+    color: #f9fafb;
+}
+.ts-hero {
+    margin-top: 1rem;
+    padding: 1.8rem 2.2rem;
+    border-radius: 18px;
+    background: radial-gradient(circle at top left, #1d4ed8 0, #020617 45%, #020617 100%);
+    border: 1px solid #1f2937;
+    box-shadow: 0 18px 45px rgba(0,0,0,0.55);
+}
+.ts-hero-title {
+    font-size: 2.2rem;
+    font-weight: 700;
+    letter-spacing: 0.02em;
+}
+.ts-hero-subtitle {
+    margin-top: 0.4rem;
+    color: #9ca3af;
+    font-size: 0.95rem;
+}
+.ts-accent { color: #38bdf8; }
+.ts-subtle { color: #9ca3af; font-size: 0.9rem; }
+
+.auth-wrapper {
+    max-width: 980px;
+    margin: 2.0rem auto 1rem auto;
+}
+.auth-left-kicker {
+    font-size: 0.85rem;
+    letter-spacing: 0.14em;
+    text-transform: uppercase;
+    color: #6b7280;
+    margin-bottom: 0.4rem;
+}
+.auth-left-title {
+    font-size: 1.5rem;
+    font-weight: 600;
+    margin-bottom: 0.35rem;
+}
+.auth-subcopy {
+    font-size: 0.9rem;
+    color: #9ca3af;
+    margin-bottom: 0.75rem;
+}
+.auth-bullets {
+    margin: 0.3rem 0 0.2rem 0;
+    padding-left: 1.3rem;
+    color: #d1d5db;
+    font-size: 0.9rem;
+}
+.auth-bullets li {
+    margin-bottom: 0.25rem;
+}
+.auth-pill {
+    display: inline-flex;
+    align-items: center;
+    gap: 0.45rem;
+    padding: 0.2rem 0.7rem;
+    border-radius: 999px;
+    background: rgba(15, 23, 42, 0.85);
+    border: 1px solid rgba(148, 163, 184, 0.4);
+    font-size: 0.75rem;
+    color: #e5e7eb;
+    margin-top: 0.6rem;
+    margin-bottom: 0.9rem;
+}
+.auth-pill-dot {
+    width: 7px;
+    height: 7px;
+    border-radius: 999px;
+    background: #22c55e;
+}
+
+.stForm {
+    background: rgba(15, 23, 42, 0.97);
+    border-radius: 18px;
+    padding: 1.6rem 1.7rem !important;
+    border: 1px solid rgba(148, 163, 184, 0.35);
+    box-shadow: 0 20px 55px rgba(0,0,0,0.65);
+}
+.stTabs {
+    margin-top: 0.8rem;
+}
+.stTabs [role="tablist"] {
+    gap: 0.5rem;
+}
+.stTabs [role="tab"] {
+    padding: 0.25rem 0.9rem;
+    border-radius: 999px;
+    font-size: 0.9rem;
+}
+.ts-card {
+    background-color: #020617;
+    border-radius: 18px;
+    padding: 1.5rem;
+    border: 1px solid #1e293b;
+    box-shadow: 0 0 30px rgba(0,0,0,0.35);
+}
+.key-moves-card {
+    background-color: #0f172a;
+    border-radius: 14px;
+    padding: 1rem 1.25rem;
+    border: 1px solid #1d4ed8;
+}
+</style>
+"""
+
+
 def inject_css():
-    st.markdown(
-        """
-        <style>
-        .main {
-            background-color: #020617;
-            color: #f9fafb;
-        }
-        .ts-hero {
-            margin-top: 1rem;
-            padding: 1.8rem 2.2rem;
-            border-radius: 18px;
-            background: radial-gradient(circle at top left, #1d4ed8 0, #020617 45%, #020617 100%);
-            border: 1px solid #1f2937;
-            box-shadow: 0 18px 45px rgba(0,0,0,0.55);
-        }
-        .ts-hero-title {
-            font-size: 2.2rem;
-            font-weight: 700;
-            letter-spacing: 0.02em;
-        }
-        .ts-hero-subtitle {
-            margin-top: 0.4rem;
-            color: #9ca3af;
-            font-size: 0.95rem;
-        }
-        .ts-accent { color: #38bdf8; }
-        .ts-subtle { color: #9ca3af; font-size: 0.9rem; }
+    st.markdown(_CSS, unsafe_allow_html=True)
 
-        .auth-wrapper {
-            max-width: 980px;
-            margin: 2.0rem auto 1rem auto;
-        }
-        .auth-left-kicker {
-            font-size: 0.85rem;
-            letter-spacing: 0.14em;
-            text-transform: uppercase;
-            color: #6b7280;
-            margin-bottom: 0.4rem;
-        }
-        .auth-left-title {
-            font-size: 1.5rem;
-            font-weight: 600;
-            margin-bottom: 0.35rem;
-        }
-        .auth-subcopy {
-            font-size: 0.9rem;
-            color: #9ca3af;
-            margin-bottom: 0.75rem;
-        }
-        .auth-bullets {
-            margin: 0.3rem 0 0.2rem 0;
-            padding-left: 1.3rem;
-            color: #d1d5db;
-            font-size: 0.9rem;
-        }
-        .auth-bullets li {
-            margin-bottom: 0.25rem;
-        }
-        .auth-pill {
-            display: inline-flex;
-            align-items: center;
-            gap: 0.45rem;
-            padding: 0.2rem 0.7rem;
-            border-radius: 999px;
-            background: rgba(15, 23, 42, 0.85);
-            border: 1px solid rgba(148, 163, 184, 0.4);
-            font-size: 0.75rem;
-            color: #e5e7eb;
-            margin-top: 0.6rem;
-            margin-bottom: 0.9rem;
-        }
-        .auth-pill-dot {
-            width: 7px;
-            height: 7px;
-            border-radius: 999px;
-            background: #22c55e;
-        }
 
-        .stForm {
-            background: rgba(15, 23, 42, 0.97);
-            border-radius: 18px;
-            padding: 1.6rem 1.7rem !important;
-            border: 1px solid rgba(148, 163, 184, 0.35);
-            box-shadow: 0 20px 55px rgba(0,0,0,0.65);
-        }
-        .stTabs {
-            margin-top: 0.8rem;
-        }
-        .stTabs [role="tablist"] {
-            gap: 0.5rem;
-        }
-        .stTabs [role="tab"] {
-            padding: 0.25rem 0.9rem;
-            border-radius: 999px;
-            font-size: 0.9rem;
-        }
-        .ts-card {
-            background-color: #020617;
-            border-radius: 18px;
-            padding: 1.5rem;
-            border: 1px solid #1e293b;
-            box-shadow: 0 0 30px rgba(0,0,0,0.35);
-        }
-        .key-moves-card {
-            background-color: #0f172a;
-            border-radius: 14px;
-            padding: 1rem 1.25rem;
-            border: 1px solid #1d4ed8;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
+def scroll_to_top_once(view: str):
+    """
+    Scroll the page to the top the first time a view (auth screen, main app) is
+    shown in this session, instead of mounting a fresh iframe on every rerun.
+    """
+    if st.session_state.get("_scrolled_view") == view:
+        return
+    st.session_state["_scrolled_view"] = view
+    components.html("<script>window.scrollTo(0, 0);</script>", height=0)
 
 
 # =========================================================
 # 4. FINANCE LOGIC & CHARTS
 # =========================================================
 
+# Shared layout settings, built once instead of on every rerun.
+_VAL_LAYOUT = dict(
+    template="plotly_dark",
+    title="Pre-money valuation sensitivity",
+    yaxis=dict(tickformat=","),
+    showlegend=False,
+)
+_OWN_LAYOUT = dict(
+    template="plotly_dark",
+    title="Post-money ownership split",
+    showlegend=True,
+)
+_WF_LAYOUT = dict(
+    template="plotly_dark",
+    barmode="stack",
+    yaxis=dict(tickformat=","),
+)
+_WF_CURVE_LAYOUT = dict(
+    template="plotly_dark",
+    xaxis=dict(tickformat=","),
+    yaxis=dict(tickformat=","),
+)
+
 def implied_revenue_multiple(pre: float, rev: float):
     if rev and rev > 0:
         return pre / rev
     return None
 
 
+@st.cache_data(show_spinner=False, max_entries=64)
 def plot_valuation(pre: float, currency: str):
+    import plotly.graph_objects as go
+
     if pre <= 0:
         return None
     fig = go.Figure()
@@ -674,38 +1124,118 @@ def plot_valuation(pre: float, currency: str):
         )
     )
     fig.update_layout(
-        template="plotly_dark",
-        title="Pre-money valuation sensitivity",
+        **_VAL_LAYOUT,
         yaxis_title=f"Pre-money ({currency})",
-        yaxis=dict(tickformat=","),
-        showlegend=False,
     )
     return fig
 
 
-def waterfall(pre, invest, liq_mult, liq_type, equity, exit_v):
-    if pre <= 0 or invest <= 0 or liq_mult <= 0 or exit_v <= 0:
-        return 0.0, 0.0
+def is_non_participating(liq_type: str) -> bool:
+    return "non-participating" in liq_type.lower()
+
+
+def waterfall_vec(pre, invest, liq_mult, non_participating, equity, exit_arr):
+    """
+    Single-round liquidation waterfall for an array of exit values.
+    The investor takes its preference (invest * liq_mult); non-participating
+    preferred takes the larger of that and its pro-rata share, participating
+    preferred takes the preference plus its share of the remainder. Payouts are
+    capped at the exit value and the rest goes to founders/common.
+    Returns (investor_payouts, founder_payouts) as NumPy arrays.
+    """
+    import numpy as np
+
+    exit_arr = np.asarray(exit_arr, dtype=float)
+    if pre <= 0 or invest <= 0 or liq_mult <= 0:
+        zeros = np.zeros_like(exit_arr)
+        return zeros, zeros.copy()
 
     post = pre + invest
     owner = equity / 100.0 if equity > 0 else invest / post
     pref = invest * liq_mult
+    exits = np.maximum(exit_arr, 0.0)
 
-    liq_type_lower = liq_type.lower()
-    if "non-participating" in liq_type_lower:
-        pro_rata = owner * exit_v
-        investor_payout = min(max(pref, pro_rata), exit_v)
-        founder_payout = max(exit_v - investor_payout, 0.0)
+    if non_participating:
+        investor_payout = np.minimum(np.maximum(pref, owner * exits), exits)
     else:
-        remaining = max(exit_v - pref, 0.0)
-        investor_extra = owner * remaining
-        investor_payout = min(pref + investor_extra, exit_v)
-        founder_payout = max(exit_v - investor_payout, 0.0)
+        investor_payout = np.minimum(pref + owner * np.maximum(exits - pref, 0.0), exits)
+    founder_payout = np.maximum(exits - investor_payout, 0.0)
 
     return investor_payout, founder_payout
 
 
+def compute_analytics(inputs: dict) -> dict:
+    """
+    Deterministic deal math for the prompt, so the model narrates the numbers
+    instead of re-deriving them.
+    """
+    pre = inputs.get("pre_money") or 0.0
+    invest = inputs.get("investment_amount") or 0.0
+    equity = inputs.get("equity_percentage") or 0.0
+    liq_mult = inputs.get("liq_multiple") or 0.0
+    liq_type = inputs.get("liq_type") or ""
+    base_exit = inputs.get("assumed_exit") or 0.0
+
+    analytics = {
+        "post_money_valuation": None,
+        "new_investor_ownership_percent": None,
+        "existing_holders_ownership_percent": None,
+        "implied_revenue_multiple": None,
+        "waterfall": None,
+    }
+    if pre <= 0 or invest <= 0:
+        return analytics
+
+    post = pre + invest
+    new_investor = equity if equity > 0 else invest / post * 100.0
+    rev_multiple = implied_revenue_multiple(pre, inputs.get("revenue"))
+    analytics.update(
+        post_money_valuation=round(post, 2),
+        new_investor_ownership_percent=round(new_investor, 2),
+        existing_holders_ownership_percent=round(max(100.0 - new_investor, 0.0), 2),
+        implied_revenue_multiple=round(rev_multiple, 2) if rev_multiple else None,
+    )
+
+    if base_exit > 0 and liq_mult > 0:
+        scenarios = (("low_0_5x", 0.5), ("base_1x", 1.0), ("high_2x", 2.0))
+        exits = [factor * base_exit for _, factor in scenarios]
+        inv_vals, fnd_vals = waterfall_vec(
+            pre, invest, liq_mult, is_non_participating(liq_type), equity, exits
+        )
+        analytics["waterfall"] = {
+            label: {
+                "exit_value": round(exit_v, 2),
+                "investor_payout": round(float(inv), 2),
+                "founder_common_payout": round(float(fnd), 2),
+            }
+            for (label, _), exit_v, inv, fnd in zip(scenarios, exits, inv_vals, fnd_vals)
+        }
+
+    return analytics
+
+
+BIG_POOL_PERCENT = 15.0
+
+
+def fast_flags(inputs: dict) -> list[str]:
+    """Rule-based red flags that need no model call to spot."""
+    flags = []
+    liq_type = (inputs.get("liq_type") or "").lower()
+    if "participating" in liq_type and not is_non_participating(liq_type):
+        flags.append("PARTICIPATING_LIQ")
+    if (inputs.get("liq_multiple") or 0.0) > 1.0:
+        flags.append(">1x_LIQ")
+    if (inputs.get("anti_dilution") or "").lower() == "full ratchet":
+        flags.append("FULL_RATCHET")
+    if (inputs.get("option_pool_post") or 0.0) > BIG_POOL_PERCENT:
+        flags.append("BIG_POOL")
+    return flags
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
 def plot_ownership(pre, invest, equity_pct):
+    import plotly.graph_objects as go
+
     if pre <= 0 or invest <= 0:
         return None
 
@@ -726,26 +1256,23 @@ def plot_ownership(pre, invest, equity_pct):
             )
         ]
     )
-    fig.update_layout(
-        template="plotly_dark",
-        title="Post-money ownership split",
-        showlegend=True,
-    )
+    fig.update_layout(**_OWN_LAYOUT)
     return fig
 
 
+@st.cache_data(show_spinner=False, max_entries=64)
 def plot_waterfall_scenarios(pre, invest, liq_mult, liq_type, equity, currency, base_exit):
+    import numpy as np
+    import plotly.graph_objects as go
+
     if base_exit <= 0:
         return None
 
-    exits = [0.5 * base_exit, base_exit, 2.0 * base_exit]
+    exits = np.array([0.5, 1.0, 2.0]) * base_exit
     labels = [f"0.5× ({exits[0]:,.0f})", f"1.0× ({exits[1]:,.0f})", f"2.0× ({exits[2]:,.0f})"]
-    inv_vals, fnd_vals = [], []
-
-    for e in exits:
-        inv, fnd = waterfall(pre, invest, liq_mult, liq_type, equity, e)
-        inv_vals.append(inv)
-        fnd_vals.append(fnd)
+    inv_vals, fnd_vals = waterfall_vec(
+        pre, invest, liq_mult, is_non_participating(liq_type), equity, exits
+    )
 
     fig = go.Figure()
     fig.add_trace(
@@ -763,11 +1290,48 @@ def plot_waterfall_scenarios(pre, invest, liq_mult, liq_type, equity, currency,
         )
     )
     fig.update_layout(
-        template="plotly_dark",
-        barmode="stack",
+        **_WF_LAYOUT,
         title=f"Liquidation waterfall across exit values ({currency})",
         yaxis_title=f"Proceeds ({currency})",
-        yaxis=dict(tickformat=","),
+    )
+    return fig
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def plot_waterfall_curve(pre, invest, liq_mult, liq_type, equity, currency, base_exit):
+    import numpy as np
+    import plotly.graph_objects as go
+
+    if base_exit <= 0:
+        return None
+
+    exits = np.linspace(0.25, 3.0, 120) * base_exit
+    inv_vals, fnd_vals = waterfall_vec(
+        pre, invest, liq_mult, is_non_participating(liq_type), equity, exits
+    )
+
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scatter(
+            x=exits,
+            y=inv_vals,
+            name="Investors",
+            stackgroup="proceeds",
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=exits,
+            y=fnd_vals,
+            name="Founders / common",
+            stackgroup="proceeds",
+        )
+    )
+    fig.update_layout(
+        **_WF_CURVE_LAYOUT,
+        title=f"Proceeds split across exit values ({currency})",
+        xaxis_title=f"Exit value ({currency})",
+        yaxis_title=f"Proceeds ({currency})",
     )
     return fig
 
@@ -776,6 +1340,27 @@ def plot_waterfall_scenarios(pre, invest, liq_mult, liq_type, equity, currency,
 # 5. PDF EXPORT
 # =========================================================
 
+# Header block of the exported PDF; filled from the deal inputs with format_map.
+SUMMARY_TMPL = """
+Generated on: {generated_on}
+
+Company: {company_name}
+Industry: {industry} | Stage: {stage} | Round: {round_label}
+Country: {country} | Currency: {currency}
+
+Pre-money valuation: {pre_money:,.0f}
+Investment amount: {investment_amount:,.0f}
+Equity offered: {equity_percentage:.1f}% ({instrument})
+
+Liquidation preference: {liq_multiple}x ({liq_type})
+Anti-dilution: {anti_dilution}
+Board seats: {board_seats}
+Option pool target (post): {option_pool_post:.1f}%
+
+Assumed exit (for visuals): {assumed_exit:,.0f}
+"""
+
+
 def _sanitize_for_pdf(text: str) -> str:
     if text is None:
         return ""
@@ -786,7 +1371,9 @@ def _sanitize_for_pdf(text: str) -> str:
 
 
 def generate_pdf(summary_text: str, recommendations: str):
-    if not FPDF_AVAILABLE:
+    try:
+        from fpdf import FPDF
+    except ImportError:
         return None
 
     summary_text = _sanitize_for_pdf(summary_text)
@@ -809,15 +1396,16 @@ def generate_pdf(summary_text: str, recommendations: str):
     pdf.set_font("Arial", "", 11)
     pdf.multi_cell(0, 6, recommendations)
 
-    data = pdf.output(dest="S")
-    if isinstance(data, str):
-        pdf_bytes = data.encode("latin-1", "replace")
-    else:
-        pdf_bytes = bytes(data)
+    # fpdf2 returns a bytearray; BytesIO takes it as-is (no intermediate
+    # bytes() copy) and starts at position 0, so no seek is needed.
+    return BytesIO(pdf.output())
+
 
-    buf = BytesIO(pdf_bytes)
-    buf.seek(0)
-    return buf
+@st.cache_data(max_entries=16, show_spinner=False)
+def _cached_pdf(summary_text: str, recommendations: str) -> bytes:
+    """PDF bytes for the download button, rebuilt only when the content changes."""
+    buf = generate_pdf(summary_text, recommendations)
+    return buf.getvalue() if buf else b""
 
 
 # =========================================================
@@ -836,24 +1424,16 @@ def signin_form(cookie_manager):
     if ok:
         user = get_user_by_email(email)
         if user and verify_password(pw, user["password_hash"]):
+            # Upgrade legacy hashes to the current KDF while we hold the password.
+            new_hash = hash_password(pw) if password_needs_rehash(user["password_hash"]) else None
+            raw_token, token_hash = new_remember_token() if remember else (None, None)
+            record_sign_in(user["id"], password_hash=new_hash, remember_token_hash=token_hash)
+            if new_hash:
+                user["password_hash"] = new_hash
             st.session_state["user"] = user
 
-            if remember:
-                raw_token = secrets.token_hex(32)
-                token_hash = hashlib.sha256(raw_token.encode()).hexdigest()
-
-                engine = get_engine()
-                with engine.begin() as conn:
-                    conn.execute(
-                        text("UPDATE users SET remember_token_hash = :th WHERE id = :uid"),
-                        {"th": token_hash, "uid": user["id"]},
-                    )
-
-                cookie_manager.set(
-                    "tsgpt_remember",
-                    raw_token,
-                    max_age=60 * 60 * 24 * 30,  # 30 days
-                )
+            if raw_token:
+                cookie_manager.set(REMEMBER_COOKIE, raw_token, max_age=REMEMBER_MAX_AGE)
 
             st.success("You are now signed in.")
             st.rerun()
@@ -885,24 +1465,14 @@ def signup_form(cookie_manager):
             st.error("An account with this email already exists. Please sign in instead.")
             return
 
-        user = create_user(name, email, pw)
+        # The remember-me token hash goes into the same INSERT as the account.
+        raw_token, token_hash = new_remember_token() if remember else (None, None)
+        user = create_user(name, email, pw, remember_token_hash=token_hash)
         if user:
             st.session_state["user"] = user
 
             if remember:
-                raw_token = secrets.token_hex(32)
-                token_hash = hashlib.sha256(raw_token.encode()).hexdigest()
-                engine = get_engine()
-                with engine.begin() as conn:
-                    conn.execute(
-                        text("UPDATE users SET remember_token_hash = :th WHERE id = :uid"),
-                        {"th": token_hash, "uid": user["id"]},
-                    )
-                cookie_manager.set(
-                    "tsgpt_remember",
-                    raw_token,
-                    max_age=60 * 60 * 24 * 30,
-                )
+                cookie_manager.set(REMEMBER_COOKIE, raw_token, max_age=REMEMBER_MAX_AGE)
 
             st.success("Account created! You are now signed in.")
             st.rerun()
@@ -968,36 +1538,434 @@ def render_auth_screen(cookie_manager):
 # 7. OUTPUT PARSING
 # =========================================================
 
+_TOP_MOVES_HEADER_RE = re.compile(r"Your Top 3 Moves[^\n]*\n?")
+# From the first line that starts like a move ("Move 1", "- ...", "1. ...")
+# up to the next blank line.
+_TOP_MOVES_BLOCK_RE = re.compile(
+    r"^[^\S\n]*(?:(?i:move)|-|\d).*?(?=\n[^\S\n]*\n|\Z)",
+    re.M | re.S,
+)
+_TOP_MOVE_LINE_RE = re.compile(r"^[^\S\n]*((?:(?i:move)|-|\d)[^\n]*?)[^\S\n]*$", re.M)
+
+
 def extract_top_moves(text: str):
     if not text:
         return []
-    lines = text.splitlines()
-    moves = []
-    in_section = False
-    for line in lines:
-        stripped = line.strip()
-        if "Your Top 3 Moves" in stripped:
-            in_section = True
-            continue
-        if in_section:
-            if not stripped:
-                if moves:
-                    break
-                else:
-                    continue
-            if (
-                stripped.lower().startswith("move")
-                or stripped.startswith("-")
-                or stripped[:1].isdigit()
-            ):
-                moves.append(stripped)
-    return moves[:3]
+    header = _TOP_MOVES_HEADER_RE.search(text)
+    if not header:
+        return []
+    block = _TOP_MOVES_BLOCK_RE.search(text, header.end())
+    if not block:
+        return []
+    return _TOP_MOVE_LINE_RE.findall(block.group())[:3]
 
 
 # =========================================================
 # 8. MAIN APP
 # =========================================================
 
+def stream_analysis(payload: dict, prompt_cache_key: str) -> str:
+    """
+    Stream the analysis into a temporary box and return the full text.
+    If the primary model's answer is incomplete (or errors), the fallback model
+    streams into the same box. The box is cleared once done so the structured
+    results panel can take over.
+    """
+    stream_box = st.empty()
+    recs = ""
+    for model in _analysis_models():
+        try:
+            with stream_box.container():
+                candidate = st.write_stream(
+                    stream_termsheet_gpt(payload, prompt_cache_key=prompt_cache_key, model=model)
+                )
+        except Exception as e:
+            # Keep an earlier (incomplete) answer over an error.
+            if not recs or recs.startswith(API_ERROR_PREFIX):
+                recs = f"{API_ERROR_PREFIX}: {e}"
+            continue
+        recs = candidate
+        if is_complete_analysis(recs):
+            break
+    stream_box.empty()
+    return recs
+
+
+@dataclass(frozen=True, slots=True)
+class DealInputs:
+    """One submitted deal, as kept in session_state for the results panel."""
+    company_name: str
+    industry: str
+    stage: str
+    round_label: str
+    country: str
+    currency: str
+    revenue: float
+    growth: float
+    description: str
+    pre_money: float
+    investment_amount: float
+    equity_percentage: float
+    instrument: str
+    liq_multiple: float
+    liq_type: str
+    anti_dilution: str
+    board_seats: int
+    board_terms_text: str
+    veto_terms_text: str
+    safes_notes_details: str
+    option_pool_post: float
+    other_terms: str
+    assumed_exit: float
+    prio_valuation: int
+    prio_dilution: int
+    prio_control: int
+    prio_speed: int
+    priority_notes: str
+    investor_type: str
+    leverage: str
+    investor_reputation: str
+
+
+# Keys of the inputs dict built by render_deal_form, in form order.
+DEAL_FIELDS = tuple(f.name for f in fields(DealInputs))
+
+
+# Deal form layout. Each section is (subheader, rows); a row is either one
+# field (key, widget, kwargs) or a tuple of columns, each a tuple of fields.
+# Sections after the first are preceded by a divider.
+FORM_SPEC = (
+    ("Company & Round Basics", (
+        ("company_name", st.text_input, {"label": "Company name"}),
+        ("industry", st.text_input, {"label": "Industry / vertical"}),
+        ("stage", st.selectbox, {
+            "label": "Company stage",
+            "options": ["Pre-seed", "Seed", "Series A", "Series B", "Later"],
+        }),
+        ("round_label", st.text_input, {"label": "Round label (e.g., Seed, Series A)", "value": "Series A"}),
+        ("country", st.text_input, {"label": "Country/Region", "value": "United States"}),
+        ("currency", st.selectbox, {"label": "Currency", "options": ["USD", "EUR", "GBP"]}),
+        (
+            (
+                ("revenue", st.number_input, {
+                    "label": "Annual revenue / ARR ('000)",
+                    "min_value": 0,
+                    "value": 0,
+                    "step": 10,
+                    "format": "%d",
+                    "help": "Enter revenue in thousands. Example: 500 = 500,000.",
+                }),
+            ),
+            (
+                ("growth", st.number_input, {
+                    "label": "YoY growth (%)",
+                    "min_value": -100.0,
+                    "value": 50.0,
+                    "step": 0.1,
+                    "format": "%.1f",
+                    "help": "Year-over-year revenue growth.",
+                }),
+            ),
+        ),
+        ("description", st.text_area, {
+            "label": "Business description",
+            "height": 80,
+            "help": "Briefly describe your product, target customer, and traction.",
+        }),
+    )),
+    ("Economics & Security", (
+        (
+            (
+                ("pre_money", st.number_input, {
+                    "label": "Pre-money valuation ('000)",
+                    "min_value": 0,
+                    "value": 10_000,
+                    "step": 500,
+                    "format": "%d",
+                    "help": "Pre-money valuation in thousands. Example: 10,000 = 10,000,000.",
+                }),
+                ("investment_amount", st.number_input, {
+                    "label": "Investment amount ('000)",
+                    "min_value": 0,
+                    "value": 3_000,
+                    "step": 250,
+                    "format": "%d",
+                    "help": "Investment amount in thousands. Example: 3,000 = 3,000,000.",
+                }),
+            ),
+            (
+                ("equity_percentage", st.number_input, {
+                    "label": "Equity % offered",
+                    "min_value": 0.0,
+                    "max_value": 100.0,
+                    "value": 20.0,
+                    "step": 1.0,
+                    "help": "Percentage of fully diluted equity you are offering.",
+                }),
+                ("instrument", st.selectbox, {
+                    "label": "Instrument",
+                    "options": ["Preferred Equity", "SAFE", "Convertible Note", "Common Equity"],
+                }),
+            ),
+        ),
+    )),
+    ("Key Investor Terms", (
+        (
+            (
+                ("liq_multiple", st.number_input, {
+                    "label": "Liquidation preference multiple (x)",
+                    "min_value": 0.5,
+                    "max_value": 3.0,
+                    "value": 1.0,
+                    "step": 0.5,
+                    "help": "How many times the investor's money returns before common.",
+                }),
+                ("liq_type", st.selectbox, {
+                    "label": "Liquidation preference type",
+                    "options": ["Non-participating preferred", "Participating preferred"],
+                    "help": "Non-participating vs participating preferred.",
+                }),
+            ),
+            (
+                ("anti_dilution", st.selectbox, {
+                    "label": "Anti-dilution protection",
+                    "options": ["None", "Broad-based weighted-average", "Narrow-based weighted-average", "Full ratchet"],
+                    "help": "How investor price adjusts in a down round.",
+                }),
+                ("board_seats", st.number_input, {
+                    "label": "Board seats for investors",
+                    "min_value": 0,
+                    "value": 1,
+                    "step": 1,
+                    "help": "Formal board seats granted to investors.",
+                }),
+            ),
+        ),
+        ("board_terms_text", st.text_area, {
+            "label": "Board & control terms (optional)",
+            "height": 60,
+            "help": "Paste any relevant board composition / voting / control language (optional).",
+        }),
+        ("veto_terms_text", st.text_area, {
+            "label": "Veto / protective provisions (optional)",
+            "height": 60,
+            "help": "Paste key veto rights or protective provisions if you have them.",
+        }),
+        ("safes_notes_details", st.text_area, {
+            "label": "Existing SAFEs / notes (optional)",
+            "height": 60,
+            "help": "Describe outstanding SAFEs/convertible notes, caps/discounts, or paste terms.",
+        }),
+        ("option_pool_post", st.number_input, {
+            "label": "Post-money option pool target (%) (optional)",
+            "min_value": 0.0,
+            "max_value": 40.0,
+            "value": 10.0,
+            "step": 1.0,
+            "help": "Rough target for ESOP post-money (if relevant).",
+        }),
+        ("other_terms", st.text_area, {
+            "label": "Other key terms / concerns",
+            "height": 80,
+            "help": "Anything else that matters in this negotiation (pro rata, MFN, information rights, etc.).",
+        }),
+    )),
+    ("Founder Priorities", (
+        (
+            (("prio_valuation", st.slider, {"label": "Valuation", "min_value": 1, "max_value": 5, "value": 4}),),
+            (("prio_dilution", st.slider, {"label": "Dilution", "min_value": 1, "max_value": 5, "value": 4}),),
+            (("prio_control", st.slider, {"label": "Control", "min_value": 1, "max_value": 5, "value": 5}),),
+            (("prio_speed", st.slider, {"label": "Speed to close", "min_value": 1, "max_value": 5, "value": 3}),),
+        ),
+        ("priority_notes", st.text_area, {
+            "label": "Anything else about your goals for this round? (optional)",
+            "height": 60,
+        }),
+    )),
+    ("Investor Context", (
+        ("investor_type", st.selectbox, {
+            "label": "Lead investor type",
+            "options": [
+                "Not specified",
+                "Top-tier VC",
+                "Emerging / new VC",
+                "Angel / super-angel",
+                "Strategic / Corporate",
+                "Family office / fund of funds",
+                "Other",
+            ],
+        }),
+        ("leverage", st.selectbox, {
+            "label": "Who has more leverage right now?",
+            "options": ["Not specified", "Founder (multiple term sheets)", "Balanced", "Investor (few options)"],
+        }),
+        ("investor_reputation", st.selectbox, {
+            "label": "Investor reputation",
+            "options": ["Not specified", "Very strong / brand-name", "Good but not top-tier", "Unknown / mixed", "Potentially problematic"],
+        }),
+    )),
+    (None, (
+        ("assumed_exit", st.slider, {
+            "label": "Assumed exit value for waterfall ('000)",
+            "min_value": 100,
+            "max_value": 300_000,
+            "value": 50_000,
+            "step": 100,
+            "help": "Exit value in thousands. Example: 50,000 = 50,000,000.",
+        }),
+    )),
+)
+
+# Money fields entered in thousands ('000) and stored in full units.
+THOUSANDS_FIELDS = frozenset({"revenue", "pre_money", "investment_amount", "assumed_exit"})
+
+
+def _render_field(values: dict, key: str, widget, kwargs: dict):
+    value = widget(**kwargs)
+    values[key] = value * 1000.0 if key in THOUSANDS_FIELDS else value
+
+
+def render_deal_form():
+    """Render the deal input form from FORM_SPEC; returns (submitted, inputs)."""
+    values = {}
+    with st.form("deal_form"):
+        for i, (heading, rows) in enumerate(FORM_SPEC):
+            if i:
+                st.markdown("---")
+            if heading:
+                st.subheader(heading)
+            for row in rows:
+                if isinstance(row[0], str):
+                    _render_field(values, *row)
+                    continue
+                for col, col_fields in zip(st.columns(len(row)), row):
+                    with col:
+                        for field in col_fields:
+                            _render_field(values, *field)
+
+        submitted = st.form_submit_button("Generate negotiation playbook")
+
+    inputs = {name: values[name] for name in DEAL_FIELDS}
+    return submitted, inputs
+
+
+@st.fragment
+def render_pdf_export(recs: str, deal: DealInputs):
+    """Download button in its own fragment, so a click doesn't redraw the charts."""
+    # Read here rather than passed in: fragment reruns reuse the arguments of
+    # the last full run. Truncated to the minute the PDF shows, so the summary
+    # text (and the cached PDF keyed on it) only changes once a minute.
+    now_utc = datetime.utcnow().replace(second=0, microsecond=0)
+    st.markdown("##### Export as PDF")
+
+    summary_text = SUMMARY_TMPL.format_map({
+        **asdict(deal),
+        "generated_on": now_utc.strftime("%Y-%m-%d %H:%M UTC"),
+        "company_name": deal.company_name or "N/A",
+        "industry": deal.industry or "N/A",
+    })
+
+    pdf_bytes = _cached_pdf(summary_text, recs)
+    if pdf_bytes:
+        st.download_button(
+            "Download PDF",
+            pdf_bytes,
+            file_name="TermSheetGPT_summary.pdf",
+            mime="application/pdf",
+        )
+    else:
+        st.caption("Install `fpdf2` to enable PDF export.")
+
+
+@st.fragment
+def render_results_panel(name: str, recs: str, deal: DealInputs):
+    """
+    Analysis, charts and PDF export for the current deal. As a fragment, its
+    own widgets rerun only this panel instead of the whole script.
+    """
+    moves = extract_top_moves(recs)
+    if moves:
+        st.markdown(
+            "<div class='key-moves-card'><b>Key Negotiation Moves</b></div>",
+            unsafe_allow_html=True,
+        )
+        for m in moves:
+            st.markdown(f"- {m}")
+        st.write("")
+
+    with st.expander("Full TermSheetGPT analysis", expanded=True):
+        st.markdown(recs)
+        if st.button(
+            "Re-generate analysis",
+            help="Ask TermSheetGPT again instead of reusing the cached analysis for this deal.",
+        ):
+            forget_cached_recs(build_json_payload(name, asdict(deal)))
+            st.session_state["regenerate"] = True
+            st.rerun()
+
+    st.markdown("##### Valuation sensitivity")
+    val_fig = plot_valuation(deal.pre_money, deal.currency)
+    if val_fig:
+        st.plotly_chart(val_fig, use_container_width=True)
+        mult = implied_revenue_multiple(deal.pre_money, deal.revenue)
+        if mult:
+            st.caption(
+                f"Implied pre-money revenue multiple: **{mult:.1f}x** "
+                f"(pre-money {deal.pre_money:,.0f} / revenue {deal.revenue:,.0f})."
+            )
+    else:
+        st.caption("Enter a positive pre-money valuation to see scenarios.")
+
+    st.markdown("##### Ownership / dilution")
+    own_fig = plot_ownership(
+        deal.pre_money,
+        deal.investment_amount,
+        deal.equity_percentage,
+    )
+    if own_fig:
+        st.plotly_chart(own_fig, use_container_width=True)
+        st.caption(
+            f"New investors own ~{deal.equity_percentage:.1f}% of the company post-money "
+            "(approximate, single-round view)."
+        )
+
+    st.markdown("##### Liquidation waterfall across exits")
+    wf_fig_multi = plot_waterfall_scenarios(
+        deal.pre_money,
+        deal.investment_amount,
+        deal.liq_multiple,
+        deal.liq_type,
+        deal.equity_percentage,
+        deal.currency,
+        deal.assumed_exit,
+    )
+    if wf_fig_multi:
+        st.plotly_chart(wf_fig_multi, use_container_width=True)
+        st.caption(
+            "Stacked bars show how proceeds split between investors and founders/common "
+            "at downside (0.5×), base (1.0×), and upside (2.0×) exit values "
+            "(simplified single-round structure)."
+        )
+
+    wf_curve = plot_waterfall_curve(
+        deal.pre_money,
+        deal.investment_amount,
+        deal.liq_multiple,
+        deal.liq_type,
+        deal.equity_percentage,
+        deal.currency,
+        deal.assumed_exit,
+    )
+    if wf_curve:
+        st.plotly_chart(wf_curve, use_container_width=True)
+        st.caption(
+            "Continuous view from 0.25× to 3× the assumed exit, showing where the "
+            "liquidation preference stops binding."
+        )
+
+    render_pdf_export(recs, deal)
+
+
 def main():
     st.set_page_config(
         page_title="TermSheetGPT",
@@ -1019,37 +1987,53 @@ def main():
     if "user" not in st.session_state:
         st.session_state["user"] = None
 
-    # Attempt auto-login from cookie if no user yet
-    if st.session_state["user"] is None:
-        cookies = cookie_manager.get_all() or {}
-        raw_token = cookies.get("tsgpt_remember")
+    # Attempt auto-login from cookie if no user yet. The cookie component
+    # reports an empty jar until the browser answers, so the guard is only set
+    # once a token has actually been checked: at most one lookup per session.
+    if st.session_state["user"] is None and not st.session_state.get("_auth_attempted"):
+        # get() reads the jar the CookieManager fetched on construction;
+        # get_all() would mount a second component and round-trip again.
+        raw_token = cookie_manager.get(REMEMBER_COOKIE)
         if raw_token:
-            token_hash = hashlib.sha256(raw_token.encode()).hexdigest()
-            engine = get_engine()
-            with engine.connect() as conn:
-                row = conn.execute(
-                    text("SELECT id, name, email FROM users WHERE remember_token_hash = :th"),
-                    {"th": token_hash},
-                ).fetchone()
-            if row:
-                st.session_state["user"] = {
-                    "id": row[0],
-                    "name": row[1],
-                    "email": row[2],
-                }
+            st.session_state["_auth_attempted"] = True
+            user = _lookup_user_by_token_hash(hash_remember_token(raw_token))
+            if user:
+                st.session_state["user"] = user
             else:
-                cookie_manager.delete("tsgpt_remember")
+                cookie_manager.delete(REMEMBER_COOKIE)
 
     # If still no user, show auth screen and exit
     if not st.session_state["user"]:
         render_auth_screen(cookie_manager)
         # Force scroll to top anyway (in case browser tries to remember position)
-        components.html("<script>window.scrollTo(0, 0);</script>", height=0)
+        scroll_to_top_once("auth")
         return
 
     user = st.session_state["user"]
     name = user["name"]
 
+    # Bring back the last analysed deal once per session, so signing back in
+    # shows the previous playbook without another model call.
+    if not st.session_state.get("_deal_restored"):
+        st.session_state["_deal_restored"] = True
+        if "recs" not in st.session_state:
+            try:
+                latest = load_latest_deal(user["id"])
+            except SQLAlchemyError:
+                latest = None
+            if latest:
+                latest_inputs, form_hash, latest_recs = latest
+                # Rows saved before a form field was added or renamed can't be
+                # restored; leave the panel empty rather than fail sign-in.
+                try:
+                    deal = DealInputs(**{k: latest_inputs[k] for k in DEAL_FIELDS})
+                except (KeyError, TypeError):
+                    deal = None
+                if deal is not None:
+                    st.session_state["inputs"] = deal
+                    st.session_state["inputs_hash"] = form_hash
+                    st.session_state["recs"] = latest_recs
+
     # Header with signout
     top_col1, top_col2 = st.columns([6, 1])
     with top_col1:
@@ -1073,14 +2057,16 @@ def main():
         st.write("")
         st.write("")
         if st.button("Sign out"):
-            engine = get_engine()
-            with engine.begin() as conn:
+            with get_engine().begin() as conn:
                 conn.execute(
-                    text("UPDATE users SET remember_token_hash = NULL WHERE id = :uid"),
+                    _Q_CLEAR_REMEMBER_TOKEN,
                     {"uid": user["id"]},
                 )
-            cookie_manager.delete("tsgpt_remember")
+            _lookup_user_by_token_hash.clear()
+            cookie_manager.delete(REMEMBER_COOKIE)
             st.session_state["user"] = None
+            for key in ("recs", "inputs", "inputs_hash", "_deal_restored"):
+                st.session_state.pop(key, None)
             st.rerun()
 
     st.write("")
@@ -1088,342 +2074,56 @@ def main():
 
     # -------------------- LEFT: INPUTS --------------------
     with col1:
-        with st.form("deal_form"):
-            st.subheader("Company & Round Basics")
-
-            company_name = st.text_input("Company name")
-            industry = st.text_input("Industry / vertical")
-            stage = st.selectbox("Company stage", ["Pre-seed", "Seed", "Series A", "Series B", "Later"])
-            round_label = st.text_input("Round label (e.g., Seed, Series A)", value="Series A")
-            country = st.text_input("Country/Region", "United States")
-            currency = st.selectbox("Currency", ["USD", "EUR", "GBP"])
-
-            c1a, c1b = st.columns(2)
-            with c1a:
-                revenue_th = st.number_input(
-                    "Annual revenue / ARR ('000)",
-                    min_value=0,
-                    value=0,
-                    step=10,
-                    format="%d",
-                    help="Enter revenue in thousands. Example: 500 = 500,000."
-                )
-            with c1b:
-                growth = st.number_input(
-                    "YoY growth (%)",
-                    min_value=-100.0,
-                    value=50.0,
-                    step=0.1,
-                    format="%.1f",
-                    help="Year-over-year revenue growth."
-                )
-
-            description = st.text_area(
-                "Business description",
-                height=80,
-                help="Briefly describe your product, target customer, and traction."
-            )
-
-            st.markdown("---")
-            st.subheader("Economics & Security")
-
-            t1, t2 = st.columns(2)
-            with t1:
-                pre_money_th = st.number_input(
-                    "Pre-money valuation ('000)",
-                    min_value=0,
-                    value=10_000,
-                    step=500,
-                    format="%d",
-                    help="Pre-money valuation in thousands. Example: 10,000 = 10,000,000."
-                )
-                investment_amount_th = st.number_input(
-                    "Investment amount ('000)",
-                    min_value=0,
-                    value=3_000,
-                    step=250,
-                    format="%d",
-                    help="Investment amount in thousands. Example: 3,000 = 3,000,000."
-                )
-            with t2:
-                equity_percentage = st.number_input(
-                    "Equity % offered",
-                    min_value=0.0,
-                    max_value=100.0,
-                    value=20.0,
-                    step=1.0,
-                    help="Percentage of fully diluted equity you are offering."
-                )
-                instrument = st.selectbox(
-                    "Instrument",
-                    ["Preferred Equity", "SAFE", "Convertible Note", "Common Equity"]
-                )
-
-            st.markdown("---")
-            st.subheader("Key Investor Terms")
-
-            t3, t4 = st.columns(2)
-            with t3:
-                liq_multiple = st.number_input(
-                    "Liquidation preference multiple (x)",
-                    min_value=0.5,
-                    max_value=3.0,
-                    value=1.0,
-                    step=0.5,
-                    help="How many times the investor's money returns before common."
-                )
-                liq_type = st.selectbox(
-                    "Liquidation preference type",
-                    ["Non-participating preferred", "Participating preferred"],
-                    help="Non-participating vs participating preferred."
-                )
-            with t4:
-                anti_dilution = st.selectbox(
-                    "Anti-dilution protection",
-                    ["None", "Broad-based weighted-average", "Narrow-based weighted-average", "Full ratchet"],
-                    help="How investor price adjusts in a down round."
-                )
-                board_seats = st.number_input(
-                    "Board seats for investors",
-                    min_value=0,
-                    value=1,
-                    step=1,
-                    help="Formal board seats granted to investors."
-                )
-
-            board_terms_text = st.text_area(
-                "Board & control terms (optional)",
-                height=60,
-                help="Paste any relevant board composition / voting / control language (optional)."
-            )
-
-            veto_terms_text = st.text_area(
-                "Veto / protective provisions (optional)",
-                height=60,
-                help="Paste key veto rights or protective provisions if you have them."
-            )
-
-            safes_notes_details = st.text_area(
-                "Existing SAFEs / notes (optional)",
-                height=60,
-                help="Describe outstanding SAFEs/convertible notes, caps/discounts, or paste terms."
-            )
-
-            option_pool_post = st.number_input(
-                "Post-money option pool target (%) (optional)",
-                min_value=0.0,
-                max_value=40.0,
-                value=10.0,
-                step=1.0,
-                help="Rough target for ESOP post-money (if relevant)."
-            )
-
-            other_terms = st.text_area(
-                "Other key terms / concerns",
-                height=80,
-                help="Anything else that matters in this negotiation (pro rata, MFN, information rights, etc.)."
-            )
-
-            st.markdown("---")
-            st.subheader("Founder Priorities")
-
-            pcol1, pcol2, pcol3, pcol4 = st.columns(4)
-            with pcol1:
-                prio_valuation = st.slider("Valuation", 1, 5, 4)
-            with pcol2:
-                prio_dilution = st.slider("Dilution", 1, 5, 4)
-            with pcol3:
-                prio_control = st.slider("Control", 1, 5, 5)
-            with pcol4:
-                prio_speed = st.slider("Speed to close", 1, 5, 3)
-
-            priority_notes = st.text_area(
-                "Anything else about your goals for this round? (optional)",
-                height=60,
-            )
-
-            st.markdown("---")
-            st.subheader("Investor Context")
-
-            investor_type = st.selectbox(
-                "Lead investor type",
-                [
-                    "Not specified",
-                    "Top-tier VC",
-                    "Emerging / new VC",
-                    "Angel / super-angel",
-                    "Strategic / Corporate",
-                    "Family office / fund of funds",
-                    "Other",
-                ]
-            )
-            leverage = st.selectbox(
-                "Who has more leverage right now?",
-                ["Not specified", "Founder (multiple term sheets)", "Balanced", "Investor (few options)"]
-            )
-            investor_reputation = st.selectbox(
-                "Investor reputation",
-                ["Not specified", "Very strong / brand-name", "Good but not top-tier", "Unknown / mixed", "Potentially problematic"]
-            )
-
-            st.markdown("---")
-            assumed_exit_th = st.slider(
-                "Assumed exit value for waterfall ('000)",
-                100,
-                300_000,
-                50_000,
-                step=100,
-                help="Exit value in thousands. Example: 50,000 = 50,000,000."
-            )
-
-            submitted = st.form_submit_button("Generate negotiation playbook")
-
-        revenue = revenue_th * 1000.0
-        pre_money = pre_money_th * 1000.0
-        investment_amount = investment_amount_th * 1000.0
-        assumed_exit = assumed_exit_th * 1000.0
-
-        inputs = {
-            "company_name": company_name,
-            "industry": industry,
-            "stage": stage,
-            "round_label": round_label,
-            "country": country,
-            "currency": currency,
-            "revenue": revenue,
-            "growth": growth,
-            "description": description,
-            "pre_money": pre_money,
-            "investment_amount": investment_amount,
-            "equity_percentage": equity_percentage,
-            "instrument": instrument,
-            "liq_multiple": liq_multiple,
-            "liq_type": liq_type,
-            "anti_dilution": anti_dilution,
-            "board_seats": board_seats,
-            "board_terms_text": board_terms_text,
-            "veto_terms_text": veto_terms_text,
-            "safes_notes_details": safes_notes_details,
-            "option_pool_post": option_pool_post,
-            "other_terms": other_terms,
-            "assumed_exit": assumed_exit,
-            "prio_valuation": prio_valuation,
-            "prio_dilution": prio_dilution,
-            "prio_control": prio_control,
-            "prio_speed": prio_speed,
-            "priority_notes": priority_notes,
-            "investor_type": investor_type,
-            "leverage": leverage,
-            "investor_reputation": investor_reputation,
-        }
-
-    if submitted:
-        save_deal(st.session_state["user"]["id"], inputs)
-        payload = build_json_payload(name, inputs)
-        with st.spinner("TermSheetGPT is analyzing your deal and building a negotiation plan..."):
-            recs = call_termsheet_gpt_with_json(payload)
-        st.session_state["recs"] = recs
-        st.session_state["inputs"] = inputs
+        submitted, inputs = render_deal_form()
 
     # -------------------- RIGHT: OUTPUT --------------------
     with col2:
         st.subheader("AI Recommendations & Visuals")
 
-        if "recs" in st.session_state:
-            recs = st.session_state["recs"]
-            deal = st.session_state["inputs"]
-
-            moves = extract_top_moves(recs)
-            if moves:
-                st.markdown(
-                    "<div class='key-moves-card'><b>Key Negotiation Moves</b></div>",
-                    unsafe_allow_html=True,
-                )
-                for m in moves:
-                    st.markdown(f"- {m}")
-                st.write("")
-
-            with st.expander("Full TermSheetGPT analysis", expanded=True):
-                st.markdown(recs)
-
-            st.markdown("##### Valuation sensitivity")
-            val_fig = plot_valuation(deal["pre_money"], deal["currency"])
-            if val_fig:
-                st.plotly_chart(val_fig, use_container_width=True)
-                mult = implied_revenue_multiple(deal["pre_money"], deal["revenue"])
-                if mult:
-                    st.caption(
-                        f"Implied pre-money revenue multiple: **{mult:.1f}x** "
-                        f"(pre-money {deal['pre_money']:,.0f} / revenue {deal['revenue']:,.0f})."
+        # Set by the "Re-generate analysis" button below, which clears the cached
+        # answer for the current deal and reruns.
+        regenerate = st.session_state.pop("regenerate", False)
+        if regenerate:
+            inputs = asdict(st.session_state["inputs"])
+
+        if submitted or regenerate:
+            inputs_hash = hash_inputs(inputs)
+            # An unchanged resubmit keeps the playbook already on screen.
+            if regenerate or st.session_state.get("inputs_hash") != inputs_hash or "recs" not in st.session_state:
+                payload = build_json_payload(name, inputs)
+                # The deal INSERT doesn't depend on the analysis, so it runs on a
+                # worker thread while the model streams.
+                with ThreadPoolExecutor(
+                    max_workers=1,
+                    initializer=add_script_run_ctx,
+                    initargs=(None, get_script_run_ctx()),
+                ) as pool:
+                    save_future = pool.submit(save_deal, user["id"], inputs) if submitted else None
+
+                    recs = stream_analysis(
+                        payload,
+                        prompt_cache_key=f"{PROMPT_CACHE_KEY}-{user['id']}",
                     )
-            else:
-                st.caption("Enter a positive pre-money valuation to see scenarios.")
-
-            st.markdown("##### Ownership / dilution")
-            own_fig = plot_ownership(
-                deal["pre_money"],
-                deal["investment_amount"],
-                deal["equity_percentage"],
-            )
-            if own_fig:
-                st.plotly_chart(own_fig, use_container_width=True)
-                st.caption(
-                    f"New investors own ~{deal['equity_percentage']:.1f}% of the company post-money "
-                    "(approximate, single-round view)."
-                )
-
-            st.markdown("##### Liquidation waterfall across exits")
-            wf_fig_multi = plot_waterfall_scenarios(
-                deal["pre_money"],
-                deal["investment_amount"],
-                deal["liq_multiple"],
-                deal["liq_type"],
-                deal["equity_percentage"],
-                deal["currency"],
-                deal["assumed_exit"],
-            )
-            if wf_fig_multi:
-                st.plotly_chart(wf_fig_multi, use_container_width=True)
-                st.caption(
-                    "Stacked bars show how proceeds split between investors and founders/common "
-                    "at downside (0.5×), base (1.0×), and upside (2.0×) exit values "
-                    "(simplified single-round structure)."
-                )
-
-            st.markdown("##### Export as PDF")
 
-            summary_text = f"""
-Generated on: {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')}
-
-Company: {deal['company_name'] or 'N/A'}
-Industry: {deal['industry'] or 'N/A'} | Stage: {deal['stage']} | Round: {deal['round_label']}
-Country: {deal['country']} | Currency: {deal['currency']}
-
-Pre-money valuation: {deal['pre_money']:,.0f}
-Investment amount: {deal['investment_amount']:,.0f}
-Equity offered: {deal['equity_percentage']:.1f}% ({deal['instrument']})
-
-Liquidation preference: {deal['liq_multiple']}x ({deal['liq_type']})
-Anti-dilution: {deal['anti_dilution']}
-Board seats: {deal['board_seats']}
-Option pool target (post): {deal['option_pool_post']:.1f}%
-
-Assumed exit (for visuals): {deal['assumed_exit']:,.0f}
-"""
+                try:
+                    if save_future:
+                        save_future.result()
+                    if not recs.startswith(API_ERROR_PREFIX):
+                        save_deal_recs(user["id"], inputs_hash, recs)
+                except SQLAlchemyError as e:
+                    st.warning(f"Your analysis is ready, but the deal could not be saved: {e}")
+                st.session_state["recs"] = recs
+                st.session_state["inputs"] = DealInputs(**inputs)
+                if recs.startswith(API_ERROR_PREFIX):
+                    st.session_state.pop("inputs_hash", None)
+                else:
+                    st.session_state["inputs_hash"] = inputs_hash
 
-            pdf_buf = generate_pdf(summary_text, recs)
-            if pdf_buf:
-                st.download_button(
-                    "Download PDF",
-                    pdf_buf,
-                    file_name="TermSheetGPT_summary.pdf",
-                    mime="application/pdf",
-                )
-            else:
-                st.caption("Install `fpdf2` to enable PDF export.")
+        if "recs" in st.session_state:
+            render_results_panel(name, st.session_state["recs"], st.session_state["inputs"])
 
-    # 🔝 Always force scroll to top so users see the hero + header
-    components.html("<script>window.scrollTo(0, 0);</script>", height=0)
+    # 🔝 Scroll to top on arrival so users see the hero + header
+    scroll_to_top_once("app")
 
 
 if __name__ == "__main__":